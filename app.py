@@ -1,5 +1,8 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, abort
+from flask import Flask, render_template, stream_template, request, redirect, url_for, flash, session, abort, Response, get_flashed_messages, jsonify, stream_with_context
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
+from functools import wraps
+import click
 import os
 from datetime import datetime, timedelta
 import logging
@@ -10,6 +13,14 @@ app.config['SECRET_KEY'] = 'stanleyhub-secret-key'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///stanleyhub.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=30)  # For "remember me" functionality
+app.config['STREAM_TEMPLATES'] = os.environ.get('STREAM_TEMPLATES') == '1'  # Opt-in streaming for long pages
+app.config['STREAM_CHUNK_SIZE'] = 16 * 1024
+app.config['RATELIMIT_STORAGE'] = os.environ.get('RATELIMIT_STORAGE', 'memory')  # 'sqlite' shares limits across workers
+app.config['RATELIMIT_TRUSTED_PROXIES'] = int(os.environ.get('RATELIMIT_TRUSTED_PROXIES', '0'))  # Proxy hops in front of the app
+
+# Behind a proxy, remote_addr is the proxy's address; trust X-Forwarded-For for the configured hops
+if app.config['RATELIMIT_TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['RATELIMIT_TRUSTED_PROXIES'])
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -21,6 +32,34 @@ db.init_app(app)
 # Import models after db initialization
 from models import User, Course, Article, UserCourse, CourseStep, LearningMaterial
 
+# In-process content cache, kept consistent across gunicorn workers by the cache bus
+from cache_bus import ContentCache, CacheBus, ANY
+content_cache = ContentCache()
+cache_bus = CacheBus(content_cache)
+cache_bus.watch(Course, Article)
+cache_bus.watch(CourseStep, LearningMaterial, key=lambda obj: ('course', obj.course_id))
+cache_bus.init_app(app, db.session)
+
+from exports import EXPORTS, FORMATS as EXPORT_FORMATS, export_rows, read_enrollment_file, apply_enrollments
+
+# Rate limiting for expensive routes (password hashing, full-table search)
+from ratelimit import RateLimiter
+limiter = RateLimiter()
+limiter.init_app(app)
+
+# Typeahead index for /search/suggest, kept current through the cache bus
+from typeahead import SuggestionIndex
+suggestion_index = SuggestionIndex()
+
+@cache_bus.on_change
+def _mark_suggestions_changed(entity, entity_id):
+    if entity in ('course', 'article'):
+        suggestion_index.mark_changed(entity, entity_id)
+
+@cache_bus.on_reset
+def _reset_suggestions():
+    suggestion_index.reset()
+
 def create_sample_data():
     try:
         # --- Users ---
@@ -237,12 +276,84 @@ def init_db():
         print(f"Database initialization error: {str(e)}")
         raise
 
+def _suggestion_rows(model, *criteria):
+    columns = [model.id, model.title, model.category]
+    if model is Course:
+        columns.append(Course.featured)
+    return db.session.query(*columns).filter(*criteria).all()
+
+def refresh_suggestions():
+    if not suggestion_index.needs_refresh():
+        return
+    # Take pending changes before querying so none marked meanwhile are lost
+    pending = list(suggestion_index.take_pending())
+    applied = 0
+    try:
+        if not suggestion_index.built:
+            suggestion_index.build(_suggestion_rows(Course), _suggestion_rows(Article))
+            return
+
+        models = {'course': Course, 'article': Article}
+        for kind, item_id in pending:
+            model = models[kind]
+            if item_id is ANY:
+                # New rows: only fetch what the index hasn't seen yet
+                rows = _suggestion_rows(model, model.id > suggestion_index.max_id(kind))
+            else:
+                rows = _suggestion_rows(model, model.id == item_id)
+                if not rows:
+                    suggestion_index.remove(kind, item_id)
+            for row in rows:
+                suggestion_index.upsert(kind, *row)
+            applied += 1
+    except Exception:
+        # Keep the changes that weren't applied for the next refresh
+        for kind, item_id in pending[applied:]:
+            suggestion_index.mark_changed(kind, item_id)
+        raise
+
 # Utility function to get current user
 def get_current_user():
     if 'user_id' in session:
         return User.query.get(session['user_id'])
     return None
 
+def _coalesce(chunks, size):
+    # Jinja yields many tiny strings; send the header and navigation (with the CSS links)
+    # as soon as they are rendered, then the rest in chunks of at least `size` characters
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size or '</header>' in chunk:
+            yield ''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer)
+
+# Render a page, streaming it when STREAM_TEMPLATES is enabled.
+# Views must load all their data before calling this so DB errors still produce a 500 page.
+def render_page(template_name, **context):
+    if not app.config['STREAM_TEMPLATES']:
+        return render_template(template_name, **context)
+
+    # The session cookie is sent before the body, so pop flashed messages now
+    get_flashed_messages()
+    chunks = stream_template(template_name, **context)
+    return Response(_coalesce(chunks, app.config['STREAM_CHUNK_SIZE']), mimetype='text/html')
+
+# Restrict a view to logged-in admins
+def admin_required(view):
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        user = get_current_user()
+        if not user or not user.is_admin:
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapped
+
 # Error handlers
 @app.errorhandler(404)
 def page_not_found(e):
@@ -269,6 +380,7 @@ def index():
         return render_template('index.html', featured_courses=[], recent_articles=[])
 
 @app.route('/login', methods=['GET', 'POST'])
+@limiter.limit('login', rate=10, per=60, burst=5, methods=('POST',))
 def login():
     if 'user_id' in session:
         return redirect(url_for('dashboard'))
@@ -293,6 +405,7 @@ def login():
     return render_template('login.html')
 
 @app.route('/signup', methods=['GET', 'POST'])
+@limiter.limit('signup', rate=5, per=3600, burst=3, methods=('POST',))
 def signup():
     if 'user_id' in session:
         return redirect(url_for('dashboard'))
@@ -422,8 +535,16 @@ def courses():
             query = query.filter_by(level=level)
 
         all_courses = query.all()
-        categories = [c[0] for c in db.session.query(Course.category).distinct().all()]
-        levels = [l[0] for l in db.session.query(Course.level).distinct().all()]
+        categories = content_cache.get_or_set(
+            'course_categories',
+            lambda: [c[0] for c in db.session.query(Course.category).distinct().all()],
+            tags=[('course', ANY)]
+        )
+        levels = content_cache.get_or_set(
+            'course_levels',
+            lambda: [l[0] for l in db.session.query(Course.level).distinct().all()],
+            tags=[('course', ANY)]
+        )
 
         return render_template(
             'courses.html',
@@ -453,7 +574,7 @@ def course_detail(course_id):
             category=course.category
         ).filter(Course.id != course.id).limit(3).all()
 
-        return render_template(
+        return render_page(
             'course_detail.html',
             course=course,
             is_enrolled=is_enrolled,
@@ -498,7 +619,11 @@ def articles():
             query = query.filter_by(category=category)
 
         all_articles = query.all()
-        categories = [c[0] for c in db.session.query(Article.category).distinct().all()]
+        categories = content_cache.get_or_set(
+            'article_categories',
+            lambda: [c[0] for c in db.session.query(Article.category).distinct().all()],
+            tags=[('article', ANY)]
+        )
 
         return render_template(
             'articles.html',
@@ -519,7 +644,7 @@ def article_detail(article_id):
         ).filter(Article.id != article.id).limit(2).all()
         popular_courses = Course.query.filter_by(featured=True).limit(2).all()
 
-        return render_template(
+        return render_page(
             'article_detail.html',
             article=article,
             related_articles=related_articles,
@@ -572,6 +697,7 @@ def profile():
         return redirect(url_for('dashboard'))
 
 @app.route('/search')
+@limiter.limit('search', rate=30, per=60, burst=10, keys=('ip', 'user'))
 def search():
     try:
         query_str = request.args.get('q', '')
@@ -592,6 +718,80 @@ def search():
         flash(f'An error occurred: {str(e)}')
         return render_template('search.html', results={'courses': [], 'articles': []}, query='')
 
+@app.route('/search/suggest')
+def search_suggest():
+    prefix = request.args.get('q', '')
+    limit = min(request.args.get('limit', default=8, type=int), 20)
+    try:
+        refresh_suggestions()
+    except Exception:
+        logging.exception('Failed to refresh search suggestions')
+        return jsonify(query=prefix, suggestions=[])
+
+    urls = {
+        'course': lambda item_id: url_for('course_detail', course_id=item_id),
+        'article': lambda item_id: url_for('article_detail', article_id=item_id),
+        'course_category': lambda name: url_for('courses', category=name),
+        'article_category': lambda name: url_for('articles', category=name),
+    }
+    suggestions = [
+        {'label': label, 'type': kind, 'url': urls[kind](item_id)}
+        for kind, item_id, label in suggestion_index.suggest(prefix, limit)
+    ]
+    return jsonify(query=prefix, suggestions=suggestions)
+
+# Admin exports and bulk operations
+@app.route('/admin/export/<dataset>')
+@admin_required
+def admin_export(dataset):
+    fmt = request.args.get('format', 'csv')
+    if dataset not in EXPORTS or fmt not in EXPORT_FORMATS:
+        abort(404)
+
+    columns, rows = export_rows(dataset)
+    writer, mimetype = EXPORT_FORMATS[fmt]
+    return Response(
+        stream_with_context(writer(columns, rows)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={dataset}.{fmt}'}
+    )
+
+@app.route('/admin/enrollments/bulk', methods=['POST'])
+@admin_required
+def admin_bulk_enrollments():
+    upload = request.files.get('file')
+    if not upload:
+        return jsonify(error='No file uploaded.'), 400
+
+    unenroll = request.form.get('action') == 'unenroll'
+    try:
+        summary = apply_enrollments(read_enrollment_file(upload.stream), unenroll=unenroll)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(summary)
+
+@app.cli.command('export')
+@click.argument('dataset', type=click.Choice(sorted(EXPORTS)))
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)), default='csv')
+@click.option('--output', type=click.File('w'), default='-')
+def export_command(dataset, fmt, output):
+    """Stream a users, enrollments or progress export."""
+    columns, rows = export_rows(dataset)
+    writer, _ = EXPORT_FORMATS[fmt]
+    for chunk in writer(columns, rows):
+        output.write(chunk)
+
+@app.cli.command('bulk-enroll')
+@click.argument('file', type=click.File('rb'))
+@click.option('--unenroll', is_flag=True, help='Remove the listed enrollments instead.')
+def bulk_enroll_command(file, unenroll):
+    """Enroll (or unenroll) users listed in a CSV file."""
+    try:
+        summary = apply_enrollments(read_enrollment_file(file), unenroll=unenroll)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(', '.join(f'{k}={v}' for k, v in summary.items()))
+
 @app.route('/create_error_templates')
 def create_error_templates():
     os.makedirs('templates', exist_ok=True)
@@ -664,6 +864,7 @@ if __name__ == '__main__':
     with app.app_context():
         # Initialize database (tables + sample data)
         init_db()
+        refresh_suggestions()
 
         # Ensure error templates are present
         create_error_templates()
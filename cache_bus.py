@@ -0,0 +1,257 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from sqlalchemy import event
+
+# Cross-worker cache invalidation.
+#
+# Each worker keeps its own in-process cache. When a watched model is committed,
+# an "entity changed" event is appended to a small SQLite table shared by every
+# worker on the box. The row id is the version: workers remember the last id
+# they applied and, at most once per poll interval, fetch newer rows and drop
+# only the cache keys tagged with the changed entity.
+
+logger = logging.getLogger(__name__)
+
+ANY = None  # Tag id meaning "any row of this entity" (listings, facets, ...)
+
+
+class ContentCache:
+    def __init__(self):
+        self._data = {}
+        self._tags = {}
+        # Invalidation counters, so a value computed before an invalidation is never
+        # stored after it: per (entity, id) for specific events, per entity for any event
+        self._tag_generations = {}
+        self._entity_generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def _generation(self, tags):
+        # A tag (entity, id) goes stale on events for that id or wildcard events;
+        # a tag (entity, ANY) goes stale on any event for the entity
+        return (self._epoch,) + tuple(
+            self._entity_generations.get(entity, 0) if entity_id is ANY
+            else (self._tag_generations.get((entity, entity_id), 0),
+                  self._tag_generations.get((entity, ANY), 0))
+            for entity, entity_id in tags
+        )
+
+    def generation(self, tags):
+        with self._lock:
+            return self._generation(tags)
+
+    def set(self, key, value, tags=(), generation=None):
+        # With `generation` (from generation() before computing the value), the store
+        # is skipped if any of the tags was invalidated in the meantime
+        with self._lock:
+            if generation is not None and generation != self._generation(tags):
+                return False
+            self._data[key] = value
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            return True
+
+    def get_or_set(self, key, factory, tags=()):
+        try:
+            return self._data[key]
+        except KeyError:
+            generation = self.generation(tags)
+            value = factory()
+            self.set(key, value, tags, generation)
+            return value
+
+    def invalidate(self, entity, entity_id=ANY):
+        with self._lock:
+            self._entity_generations[entity] = self._entity_generations.get(entity, 0) + 1
+            tag = (entity, entity_id)
+            self._tag_generations[tag] = self._tag_generations.get(tag, 0) + 1
+
+            keys = self._tags.pop((entity, entity_id), set())
+            if entity_id is not ANY:
+                keys |= self._tags.pop((entity, ANY), set())
+            else:
+                # A wildcard event drops every key of that entity
+                for tag in [t for t in self._tags if t[0] == entity]:
+                    keys |= self._tags.pop(tag)
+            for key in keys:
+                self._data.pop(key, None)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._data.clear()
+            self._tags.clear()
+
+
+class CacheBus:
+    def __init__(self, cache, poll_interval=1.0, retain=10000):
+        self.cache = cache
+        self.poll_interval = poll_interval
+        self.retain = retain
+        self.path = None
+        self.last_seen = 0
+        self._next_poll = 0.0
+        self._models = []
+        self._subscribers = []
+        self._reset_subscribers = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def init_app(self, app, session):
+        self.path = app.config.get('CACHE_BUS_PATH') or os.path.join(app.instance_path, 'cache_bus.db')
+        self.poll_interval = app.config.get('CACHE_BUS_POLL_INTERVAL', self.poll_interval)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache_event ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'entity TEXT NOT NULL, '
+            'entity_id INTEGER, '
+            'created_at REAL NOT NULL)'
+        )
+        conn.commit()
+        # Start from the current head: a fresh worker has an empty cache
+        self.last_seen = conn.execute('SELECT COALESCE(MAX(id), 0) FROM cache_event').fetchone()[0]
+
+        event.listen(session, 'after_flush', self._collect)
+        event.listen(session, 'after_commit', self._after_commit)
+        event.listen(session, 'after_rollback', self._after_rollback)
+        app.before_request(self._before_request)
+
+    def watch(self, *models, key=None):
+        # key(obj) -> (entity, entity_id) lets child rows invalidate their parent,
+        # e.g. a CourseStep edit invalidates ('course', step.course_id)
+        for model in models:
+            self._models.append((model, key))
+
+    def on_change(self, callback):
+        # callback(entity, entity_id) runs for every applied event, local or remote
+        self._subscribers.append(callback)
+        return callback
+
+    def on_reset(self, callback):
+        # callback() runs when events may have been lost and the cache was cleared;
+        # anything kept in sync through on_change must be rebuilt from scratch
+        self._reset_subscribers.append(callback)
+        return callback
+
+    def _connect(self):
+        # Never reuse a connection opened before gunicorn forked the worker
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _change_for(self, obj, is_new):
+        for model, key in self._models:
+            if isinstance(obj, model):
+                if key is not None:
+                    return key(obj)
+                # New rows only affect listings; nothing can be cached under their id yet
+                return (model.__tablename__, ANY if is_new else obj.id)
+        return None
+
+    def _collect(self, session, flush_context):
+        # after_flush still sees new/dirty/deleted; remember them until the commit lands
+        pending = session.info.setdefault('cache_bus_pending', set())
+        for obj in session.new:
+            change = self._change_for(obj, True)
+            if change:
+                pending.add(change)
+        for obj in session.deleted:
+            change = self._change_for(obj, False)
+            if change:
+                pending.add(change)
+        for obj in session.dirty:
+            if session.is_modified(obj):
+                change = self._change_for(obj, False)
+                if change:
+                    pending.add(change)
+
+    def _after_commit(self, session):
+        pending = session.info.pop('cache_bus_pending', None)
+        if pending:
+            self.publish(pending)
+
+    def _after_rollback(self, session):
+        session.info.pop('cache_bus_pending', None)
+
+    def publish(self, changes):
+        changes = sorted(changes, key=lambda c: (c[0], c[1] or 0))
+        for entity, entity_id in changes:
+            self._apply(entity, entity_id)
+        if self.path is None:
+            return
+        try:
+            conn = self._connect()
+            now = time.time()
+            with conn:
+                conn.executemany(
+                    'INSERT INTO cache_event (entity, entity_id, created_at) VALUES (?, ?, ?)',
+                    [(entity, entity_id, now) for entity, entity_id in changes]
+                )
+                head = conn.execute('SELECT MAX(id) FROM cache_event').fetchone()[0]
+                if head // 500 != (head - len(changes)) // 500:
+                    conn.execute('DELETE FROM cache_event WHERE id <= ?', (head - self.retain,))
+        except sqlite3.Error:
+            # Other workers will serve stale data until their next miss; make it loud
+            logger.exception('Failed to publish cache invalidation events')
+
+    def _before_request(self):
+        # Flask treats a non-None return from before_request as the response
+        self.poll()
+
+    def poll(self, force=False):
+        now = time.monotonic()
+        if self.path is None or (not force and now < self._next_poll):
+            return 0
+        if not self._lock.acquire(blocking=False):
+            return 0
+        try:
+            self._next_poll = now + self.poll_interval
+            conn = self._connect()
+            oldest = conn.execute('SELECT MIN(id) FROM cache_event').fetchone()[0]
+            if oldest is not None and oldest > self.last_seen + 1:
+                # Events were pruned before we saw them; start over
+                logger.warning('Cache bus fell behind (last seen %s, oldest %s); clearing cache',
+                               self.last_seen, oldest)
+                self._reset()
+            rows = conn.execute(
+                'SELECT id, entity, entity_id FROM cache_event WHERE id > ? ORDER BY id',
+                (self.last_seen,)
+            ).fetchall()
+            for version, entity, entity_id in rows:
+                self._apply(entity, entity_id)
+                self.last_seen = version
+            return len(rows)
+        except sqlite3.Error:
+            logger.exception('Failed to poll cache invalidation events; clearing cache')
+            self._reset()
+            return 0
+        finally:
+            self._lock.release()
+
+    def _reset(self):
+        self.cache.clear()
+        for callback in self._reset_subscribers:
+            callback()
+
+    def _apply(self, entity, entity_id):
+        dropped = self.cache.invalidate(entity, entity_id)
+        for callback in self._subscribers:
+            callback(entity, entity_id)
+        if dropped:
+            logger.debug('Invalidated %d cache keys for %s:%s', dropped, entity, entity_id)
@@ -0,0 +1,220 @@
+import csv
+import io
+import json
+import logging
+from collections import Counter
+
+from sqlalchemy import tuple_
+
+from models import db, User, Course, UserCourse, UserProgress
+
+# Streaming exports and bulk enrollment for admins.
+#
+# Exports select plain columns (no ORM identity map) and page through them by
+# id, one short read transaction per page. Memory stays flat, and the SQLite
+# database (rollback journal, not WAL) is never held locked for the length of a
+# slow download, which would make every other write fail with "database is locked".
+
+EXPORT_BATCH_SIZE = 1000
+ENROLL_BATCH_SIZE = 500
+
+
+def _users_query():
+    return db.session.query(
+        User.id, User.name, User.email, User.is_admin, User.created_at
+    ).order_by(User.id)
+
+
+def _enrollments_query():
+    return db.session.query(
+        UserCourse.id, UserCourse.user_id, User.email, UserCourse.course_id,
+        Course.title.label('course_title'), UserCourse.enrolled_at
+    ).join(User, User.id == UserCourse.user_id).join(
+        Course, Course.id == UserCourse.course_id
+    ).order_by(UserCourse.id)
+
+
+def _progress_query():
+    return db.session.query(
+        UserProgress.id, UserProgress.user_id, User.email, UserProgress.course_id,
+        Course.title.label('course_title'), UserProgress.step_number
+    ).join(User, User.id == UserProgress.user_id).join(
+        Course, Course.id == UserProgress.course_id
+    ).order_by(UserProgress.id)
+
+
+# dataset -> (query factory, column used for keyset pagination)
+EXPORTS = {
+    'users': (_users_query, User.id),
+    'enrollments': (_enrollments_query, UserCourse.id),
+    'progress': (_progress_query, UserProgress.id),
+}
+
+
+def _pages(query_factory, key_column, page_size):
+    last_id = None
+    while True:
+        query = query_factory()
+        if last_id is not None:
+            query = query.filter(key_column > last_id)
+        page = query.limit(page_size).all()
+        # End the read transaction before the page is written out to the client
+        db.session.rollback()
+        if not page:
+            return
+        yield from page
+        if len(page) < page_size:
+            return
+        last_id = page[-1][0]
+
+
+def export_rows(dataset, page_size=EXPORT_BATCH_SIZE):
+    query_factory, key_column = EXPORTS[dataset]
+    columns = [c['name'] for c in query_factory().column_descriptions]
+    return columns, _pages(query_factory, key_column, page_size)
+
+
+def _format_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def _csv_safe(value):
+    # Spreadsheets evaluate cells starting with these characters as formulas
+    value = _format_value(value)
+    if isinstance(value, str) and value.startswith(('=', '+', '-', '@', '\t', '\r')):
+        return "'" + value
+    return value
+
+
+def stream_csv(columns, rows, batch_size=EXPORT_BATCH_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for i, row in enumerate(rows, 1):
+        writer.writerow([_csv_safe(v) for v in row])
+        if i % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_jsonl(columns, rows, batch_size=EXPORT_BATCH_SIZE):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, map(_format_value, row)))) + '\n')
+        if len(lines) >= batch_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+FORMATS = {
+    'csv': (stream_csv, 'text/csv'),
+    'jsonl': (stream_jsonl, 'application/x-ndjson'),
+}
+
+
+def read_enrollment_file(stream):
+    # Accepts CSV with a header row containing course_id and either user_id or email.
+    # The whole upload is decoded and parsed once up front, so a bad byte or
+    # malformed line is reported before any batch is committed. Reading it into
+    # memory also avoids wrapping werkzeug's SpooledTemporaryFile, which has no
+    # readable() before Python 3.11.
+    try:
+        text = stream.read().decode('utf-8-sig')
+    except UnicodeDecodeError as e:
+        raise ValueError(f'File is not valid UTF-8 (byte {e.start}); nothing was changed.')
+
+    reader = csv.DictReader(io.StringIO(text, newline=''))
+    if not reader.fieldnames or 'course_id' not in reader.fieldnames or not (
+        'user_id' in reader.fieldnames or 'email' in reader.fieldnames
+    ):
+        raise ValueError('File must have a course_id column and a user_id or email column.')
+    try:
+        for _ in reader:
+            pass
+    except csv.Error as e:
+        raise ValueError(f'Malformed CSV on line {reader.line_num + 1}: {e}; nothing was changed.')
+
+    return csv.DictReader(io.StringIO(text, newline=''))
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _resolve_batch(batch):
+    # Returns a Counter of (user_id, course_id) -> rows naming it, and the unparseable row count
+    emails = {r['email'].strip().lower() for r in batch if not r.get('user_id') and r.get('email')}
+    user_ids = {}
+    if emails:
+        user_ids = dict(db.session.query(db.func.lower(User.email), User.id).filter(
+            db.func.lower(User.email).in_(emails)
+        ).all())
+
+    pairs = Counter()
+    invalid = 0
+    for r in batch:
+        try:
+            user_id = int(r['user_id']) if r.get('user_id') else user_ids[r['email'].strip().lower()]
+            pairs[(user_id, int(r['course_id']))] += 1
+        except (KeyError, ValueError, TypeError, AttributeError):
+            invalid += 1
+    return pairs, invalid
+
+
+def apply_enrollments(rows, unenroll=False, batch_size=ENROLL_BATCH_SIZE):
+    # Each batch is its own transaction; a failing batch is rolled back and its rows
+    # counted as failed. Every row ends up in exactly one of changed, skipped
+    # (already in the requested state, or a repeat of an earlier row), invalid or failed.
+    summary = {'processed': 0, 'changed': 0, 'skipped': 0, 'invalid': 0, 'failed': 0, 'failed_batches': 0}
+    for batch in _batches(rows, batch_size):
+        summary['processed'] += len(batch)
+        pairs, invalid = _resolve_batch(batch)
+        summary['invalid'] += invalid
+        if not pairs:
+            continue
+
+        user_ids = {u for u, _ in pairs}
+        course_ids = {c for _, c in pairs}
+        try:
+            # Unknown users or courses are invalid for both actions
+            known_users = {u for (u,) in db.session.query(User.id).filter(User.id.in_(user_ids))}
+            known_courses = {c for (c,) in db.session.query(Course.id).filter(Course.id.in_(course_ids))}
+            valid = {(u, c) for u, c in pairs if u in known_users and c in known_courses}
+            existing = set(db.session.query(UserCourse.user_id, UserCourse.course_id).filter(
+                UserCourse.user_id.in_(user_ids), UserCourse.course_id.in_(course_ids)
+            ).all())
+
+            if unenroll:
+                targets = valid & existing
+                if targets:
+                    UserCourse.query.filter(
+                        tuple_(UserCourse.user_id, UserCourse.course_id).in_(sorted(targets))
+                    ).delete(synchronize_session=False)
+            else:
+                targets = valid - existing
+                db.session.bulk_insert_mappings(
+                    UserCourse, [{'user_id': u, 'course_id': c} for u, c in sorted(targets)]
+                )
+
+            db.session.commit()
+            valid_rows = sum(pairs[p] for p in valid)
+            summary['invalid'] += sum(pairs.values()) - valid_rows
+            summary['changed'] += len(targets)
+            summary['skipped'] += valid_rows - len(targets)
+        except Exception:
+            db.session.rollback()
+            logging.exception('Bulk enrollment batch failed')
+            summary['failed'] += sum(pairs.values())
+            summary['failed_batches'] += 1
+    return summary
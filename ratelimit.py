@@ -0,0 +1,161 @@
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import Response, request, session
+
+# Token-bucket rate limiting for expensive routes.
+#
+# A policy allows `rate` requests per `per` seconds with bursts of up to `burst`.
+# Buckets are keyed by route and client (IP and/or logged-in user) and live in
+# either an in-process dict or a SQLite table shared by all workers on the box.
+# Over-limit requests get a bare 429 with Retry-After before the view runs.
+
+logger = logging.getLogger(__name__)
+
+
+def _take(tokens, updated, now, capacity, rate):
+    # Refill for the elapsed time, then try to take one token.
+    # Returns (tokens, retry_after); retry_after is 0 when the request is allowed.
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryStore:
+    def __init__(self, evict_interval=60):
+        self.evict_interval = evict_interval
+        self._buckets = {}  # key -> (tokens, updated, expires)
+        self._next_evict = time.monotonic() + evict_interval
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def consume(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_evict:
+                self._evict(now)
+            tokens, updated, _ = self._buckets.get(key, (capacity, now, None))
+            tokens, retry_after = _take(tokens, updated, now, capacity, rate)
+            # Once a bucket has refilled it is the same as a missing one
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+        return retry_after
+
+    def _evict(self, now):
+        expired = [key for key, (_, _, expires) in self._buckets.items() if expires <= now]
+        for key in expired:
+            del self._buckets[key]
+        self._next_evict = now + self.evict_interval
+
+
+class SQLiteStore:
+    def __init__(self, path, evict_interval=60):
+        self.path = path
+        self.evict_interval = evict_interval
+        self._next_evict = 0.0
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS rate_bucket ('
+            'key TEXT PRIMARY KEY, '
+            'tokens REAL NOT NULL, '
+            'updated REAL NOT NULL, '
+            'expires REAL NOT NULL)'
+        )
+
+    def _connect(self):
+        # Never reuse a connection opened before gunicorn forked the worker
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def consume(self, key, capacity, rate):
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if now >= self._next_evict:
+                conn.execute('DELETE FROM rate_bucket WHERE expires <= ?', (now,))
+                self._next_evict = now + self.evict_interval
+            row = conn.execute('SELECT tokens, updated FROM rate_bucket WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens, retry_after = _take(tokens, updated, now, capacity, rate)
+            conn.execute(
+                'INSERT OR REPLACE INTO rate_bucket (key, tokens, updated, expires) VALUES (?, ?, ?, ?)',
+                (key, tokens, now, now + (capacity - tokens) / rate)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return retry_after
+
+
+def _ip_key():
+    return request.remote_addr or 'unknown'
+
+
+def _user_key():
+    # Anonymous clients fall back to their IP so the policy still applies
+    user_id = session.get('user_id')
+    return f'user:{user_id}' if user_id is not None else f'ip:{_ip_key()}'
+
+
+KEY_FUNCS = {'ip': _ip_key, 'user': _user_key}
+
+
+class RateLimiter:
+    def __init__(self, store=None):
+        self.store = store
+        self.enabled = True
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RATELIMIT_ENABLED', True)
+        if self.store is None:
+            if app.config.get('RATELIMIT_STORAGE', 'memory') == 'sqlite':
+                path = app.config.get('RATELIMIT_SQLITE_PATH') or os.path.join(app.instance_path, 'ratelimit.db')
+                self.store = SQLiteStore(path)
+            else:
+                self.store = MemoryStore()
+
+    def limit(self, name, rate, per, burst=None, keys=('ip',), methods=None):
+        # Allow `rate` requests every `per` seconds per key, with bursts up to `burst`
+        capacity = burst or rate
+        refill = rate / per
+
+        def decorator(view):
+            @wraps(view)
+            def wrapped(*args, **kwargs):
+                if self.enabled and (methods is None or request.method in methods):
+                    retry_after = self.check(name, capacity, refill, keys)
+                    if retry_after:
+                        return Response(
+                            'Too many requests. Please try again later.\n', 429,
+                            {'Retry-After': str(math.ceil(retry_after))}, mimetype='text/plain'
+                        )
+                return view(*args, **kwargs)
+            return wrapped
+        return decorator
+
+    def check(self, name, capacity, refill, keys):
+        retry_after = 0
+        for kind in keys:
+            key = f'{name}:{kind}:{KEY_FUNCS[kind]()}'
+            try:
+                retry_after = max(retry_after, self.store.consume(key, capacity, refill))
+            except sqlite3.Error:
+                # Fail open: a broken limiter store must not take the site down
+                logger.exception('Rate limiter store failed for %s', key)
+        return retry_after
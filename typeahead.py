@@ -0,0 +1,149 @@
+import bisect
+import heapq
+import re
+import threading
+
+# In-memory typeahead index for /search/suggest.
+#
+# Every course title, article title and category is indexed under each of its
+# word starts ("advanced penetration testing" is found by "adv", "pen" and
+# "tes"), in one sorted list of (key, kind, id) tuples searched with bisect.
+# Only titles and category names are held, never article or course bodies.
+
+_WORD = re.compile(r'\w+')
+
+KIND_WEIGHT = {'course': 3, 'article': 2, 'course_category': 1, 'article_category': 1}
+
+
+def normalize(text):
+    return ' '.join(_WORD.findall((text or '').lower()))
+
+
+def _keys(label):
+    words = normalize(label).split(' ')
+    return [' '.join(words[i:]) for i in range(len(words)) if words[i]]
+
+
+class SuggestionIndex:
+    def __init__(self, max_scan=2000):
+        self.max_scan = max_scan
+        self._entries = []     # sorted (key, kind, id)
+        self._items = {}       # (kind, id) -> (label, weight, category, normalized label length)
+        self._categories = {}  # (kind, name) -> number of rows using it
+        self._pending = set()
+        self.built = False
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def build(self, courses, articles):
+        # courses/articles: iterables of (id, title, category[, featured]).
+        # Callers take_pending() before querying them; changes marked after that
+        # stay pending and are applied on the next refresh
+        with self._lock:
+            self._entries = []
+            self._items = {}
+            self._categories = {}
+            for row in courses:
+                self._add_row('course', *row)
+            for row in articles:
+                self._add_row('article', *row)
+            self._entries.sort()
+            self.built = True
+
+    def mark_changed(self, kind, item_id):
+        # Called from the cache bus after a commit, where SQL can't be emitted;
+        # the change is applied on the next lookup
+        with self._lock:
+            self._pending.add((kind, item_id))
+
+    def reset(self):
+        # Changes may have been missed; the next refresh rebuilds from the database
+        with self._lock:
+            self.built = False
+
+    def needs_refresh(self):
+        return not self.built or bool(self._pending)
+
+    def max_id(self, kind):
+        return max((item_id for k, item_id in self._items if k == kind), default=0)
+
+    def take_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, set()
+            return pending
+
+    def upsert(self, kind, item_id, title, category, featured=False):
+        with self._lock:
+            self.remove(kind, item_id)
+            self._add_row(kind, item_id, title, category, featured, insort=True)
+
+    def remove(self, kind, item_id):
+        with self._lock:
+            item = self._items.pop((kind, item_id), None)
+            if item is None:
+                return
+            label, weight, category, _ = item
+            self._drop_entries(label, kind, item_id)
+            self._release_category(kind + '_category', category)
+
+    def suggest(self, prefix, limit=8):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        best = {}
+        with self._lock:
+            entries = self._entries
+            start = bisect.bisect_left(entries, (prefix,))
+            for i in range(start, min(start + self.max_scan, len(entries))):
+                key, kind, item_id = entries[i]
+                if not key.startswith(prefix):
+                    break
+                ref = (kind, item_id)
+                label, weight, _, full_length = self._items[ref]
+                # Matches at the start of the label beat matches on a later word
+                score = (len(key) == full_length, weight, -len(label))
+                if ref not in best or score > best[ref][0]:
+                    best[ref] = (score, label)
+        top = heapq.nlargest(limit, best.items(), key=lambda kv: kv[1][0])
+        return [(kind, item_id, label) for (kind, item_id), (score, label) in top]
+
+    def _add_row(self, kind, item_id, title, category, featured=False, insort=False):
+        weight = KIND_WEIGHT[kind] + (1 if featured else 0)
+        self._items[(kind, item_id)] = (title, weight, category, len(normalize(title)))
+        self._add_entries(title, kind, item_id, insort)
+        if category:
+            category_kind = kind + '_category'
+            ref = (category_kind, category)
+            count = self._categories.get(ref, 0)
+            self._categories[ref] = count + 1
+            if not count:
+                label = category.replace('_', ' ').capitalize()
+                self._items[ref] = (label, KIND_WEIGHT[category_kind], None, len(normalize(label)))
+                self._add_entries(label, category_kind, category, insort)
+
+    def _release_category(self, category_kind, category):
+        ref = (category_kind, category)
+        count = self._categories.get(ref, 0) - 1
+        if count > 0:
+            self._categories[ref] = count
+            return
+        self._categories.pop(ref, None)
+        item = self._items.pop(ref, None)
+        if item is not None:
+            self._drop_entries(item[0], category_kind, category)
+
+    def _add_entries(self, label, kind, item_id, insort):
+        for key in _keys(label):
+            if insort:
+                bisect.insort(self._entries, (key, kind, item_id))
+            else:
+                self._entries.append((key, kind, item_id))
+
+    def _drop_entries(self, label, kind, item_id):
+        for key in _keys(label):
+            entry = (key, kind, item_id)
+            i = bisect.bisect_left(self._entries, entry)
+            if i < len(self._entries) and self._entries[i] == entry:
+                del self._entries[i]